@@ -1,174 +1,404 @@
+from __future__ import annotations
+
 from flask import Flask, render_template, request, Response, jsonify
+from flask.json.provider import DefaultJSONProvider
+import jinja2
+import orjson
 import subprocess
-import json
+import os
 import platform
-import uuid
+import selectors
+import shlex
+import signal
+import threading
+import glob
+import hashlib
+import itertools
+import pickle
+import secrets
+from collections import namedtuple
+from dataclasses import dataclass
+from functools import lru_cache
+
+__all__ = ['app']
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, serializing straight to UTF-8 bytes."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # The default implementation f-strings dumps() output, which would
+        # stringify our bytes into a b'...' literal.
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+
+# Persist compiled template bytecode across restarts and skip per-request
+# template mtime checks outside of debug runs. No explicit directory: jinja2's
+# default is a per-user, mode-0700, ownership-checked dir, so no other local
+# user can plant crafted cache buckets for us to unmarshal.
+app.jinja_env.bytecode_cache = jinja2.FileSystemBytecodeCache()
+if os.environ.get('FLASK_DEBUG') != '1':
+    app.jinja_env.auto_reload = False
+
+if os.environ.get('PROFILE'):
+    # PROFILE=1 python app.py — dumps per-request cProfile stats to ./profiles
+    # (inspect with snakeviz). Off by default so production is untouched.
+    from werkzeug.middleware.profiler import ProfilerMiddleware
+    os.makedirs('./profiles', exist_ok=True)
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[30], profile_dir='./profiles')
+
+# platform.* can shell out or parse /proc on some systems and never changes
+# at runtime, so resolve everything once at import.
+SYSTEM = platform.system()
+OS_TYPE = SYSTEM.lower()
+CURRENT_PLATFORM = 'windows' if OS_TYPE == 'windows' else 'unix'
+MACHINE = platform.machine()
+VERSION = platform.version()
+
+running_processes: dict[str, tuple[subprocess.Popen, threading.Event]] = {}
 
-running_processes = {}
+# Launch each tool in its own process group so stopping it also kills any
+# helpers it forked — otherwise they keep the pipe's write end open and the
+# streaming loop never sees EOF.
+if os.name == 'posix':
+    _POPEN_GROUP_KWARGS = {'start_new_session': True}
+else:
+    _POPEN_GROUP_KWARGS = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+
+_id_counter = itertools.count()
+
+def _new_execution_id():
+    # Unique via the counter (atomic under the GIL), unguessable via the
+    # token; half the urandom bytes and formatting work of uuid4.
+    return f'{next(_id_counter):x}-{secrets.token_urlsafe(6)}'
+
+def _terminate(process):
+    """Signal the tool's whole process group, ignoring already-dead groups."""
+    try:
+        if os.name == 'posix':
+            # start_new_session guarantees pgid == child pid, and the pid
+            # stays valid as a group id even after the child is reaped —
+            # os.getpgid() on a waited-for pid would raise instead.
+            os.killpg(process.pid, signal.SIGTERM)
+        else:
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+    except (ProcessLookupError, PermissionError, OSError):
+        pass
+
+COMMANDS_FILE = 'commands.json'
+
+@lru_cache(maxsize=4)
+def _load(mtime_ns):
+    with open(COMMANDS_FILE, 'rb') as f:
+        raw = f.read()
+
+    # Cold loads come from a pickle sidecar keyed on the JSON content hash:
+    # one C-level pickle.load instead of tokenizing the JSON again.
+    digest = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    cache_path = f'commands.cache.{digest}.pkl'
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    commands = orjson.loads(raw)
+    try:
+        for stale in glob.glob('commands.cache.*.pkl'):
+            os.remove(stale)
+        with open(cache_path, 'wb') as f:
+            pickle.dump(commands, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        pass
+    return commands
 
 def load_commands():
-    with open('commands.json', 'r', encoding='utf-8') as f:
-        return json.load(f)
+    # Keyed on mtime so a stat() is the only per-request cost; the file is
+    # re-read and re-parsed only when it actually changes on disk.
+    return _load(os.stat(COMMANDS_FILE).st_mtime_ns)
 
 def filter_commands_by_platform(commands):
     """Filter commands based on current platform"""
-    os_type = platform.system().lower()
-    current_platform = 'windows' if os_type == 'windows' else 'unix'
-    
     filtered_commands = {}
-    
+
     for cmd_id, cmd_config in commands.items():
         if 'platforms' in cmd_config:
-            if current_platform not in cmd_config['platforms']:
-                continue 
-        
-        platform_config = cmd_config.get('windows' if current_platform == 'windows' else 'unix')
+            if CURRENT_PLATFORM not in cmd_config['platforms']:
+                continue
+
+        platform_config = cmd_config.get(CURRENT_PLATFORM)
         if not platform_config:
-            continue  
-        
+            continue
+
         filtered_options = []
         for option in cmd_config.get('options', []):
             if 'platforms' in option:
-                if current_platform not in option['platforms']:
-                    continue 
+                if CURRENT_PLATFORM not in option['platforms']:
+                    continue
             filtered_options.append(option)
-        
+
         filtered_cmd = cmd_config.copy()
         filtered_cmd['options'] = filtered_options
         filtered_commands[cmd_id] = filtered_cmd
-    
+
     return filtered_commands
 
+@lru_cache(maxsize=4)
+def _filtered(mtime_ns, current_platform):
+    return filter_commands_by_platform(_load(mtime_ns))
+
+def load_filtered_commands():
+    # The filter is pure in (commands blob, platform), both stable within a
+    # process, so the filtered dict is memoized alongside the parsed one.
+    return _filtered(os.stat(COMMANDS_FILE).st_mtime_ns, CURRENT_PLATFORM)
+
+# Pre-filtered for the current platform with the flag already resolved to a
+# tuple (or None). Immutable, so the compiled table escapes cyclic GC scans.
+Option = namedtuple('Option', 'id type required label flag')
+
+@dataclass(slots=True, frozen=True)
+class CompiledTool:
+    base: str
+    options: tuple[Option, ...]
+    target: str | None
+
+def _compile_commands(commands):
+    """Specialize each tool for the current platform at load time so
+    execute_command is a flat loop with no dict lookups or isinstance checks."""
+    compiled = {}
+
+    for cmd_id, cmd_config in commands.items():
+        if 'platforms' in cmd_config:
+            if CURRENT_PLATFORM not in cmd_config['platforms']:
+                continue
+
+        # Same gate as filter_commands_by_platform: a tool is executable iff
+        # it is advertised on / and /api/commands.
+        platform_config = cmd_config.get(CURRENT_PLATFORM)
+        if not platform_config:
+            continue
+
+        flags = platform_config.get('flags', {})
+        options = []
+        for option in cmd_config.get('options', []):
+            if 'platforms' in option:
+                if CURRENT_PLATFORM not in option['platforms']:
+                    continue
+            flag = flags.get(option['id'])
+            if flag is not None:
+                flag = tuple(flag) if isinstance(flag, list) else (flag,)
+            options.append(Option(
+                id=option['id'],
+                type=option['type'],
+                required=bool(option.get('required')),
+                label=option.get('label', option['id']),
+                flag=flag
+            ))
+
+        compiled[cmd_id] = CompiledTool(
+            base=platform_config['base'],
+            options=tuple(options),
+            target=cmd_config.get('target')
+        )
+
+    return compiled
+
+@lru_cache(maxsize=4)
+def _compiled(mtime_ns, current_platform):
+    return _compile_commands(_load(mtime_ns))
+
+def load_compiled_commands():
+    return _compiled(os.stat(COMMANDS_FILE).st_mtime_ns, CURRENT_PLATFORM)
+
+@lru_cache(maxsize=2)
+def _render_index(mtime_ns):
+    # The page is a pure function of the filtered commands dict, which is
+    # itself keyed on mtime, so the rendered bytes can be memoized too.
+    body = render_template('index.html', commands=_filtered(mtime_ns, CURRENT_PLATFORM)).encode('utf-8')
+    etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+    return body, etag
+
 @app.route('/')
 def index():
-    commands = load_commands()
-    filtered_commands = filter_commands_by_platform(commands)
-    return render_template('index.html', commands=filtered_commands)
+    body, etag = _render_index(os.stat(COMMANDS_FILE).st_mtime_ns)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='text/html')
+    response.set_etag(etag)
+    return response
 
 @app.route('/api/commands')
 def get_commands():
-    commands = load_commands()
-    filtered_commands = filter_commands_by_platform(commands)
-    return jsonify(filtered_commands)
+    filtered_commands = load_filtered_commands()
+
+    def stream():
+        # Emit one top-level entry per chunk so the response never
+        # materializes the whole serialized tree at once.
+        yield b'{'
+        first = True
+        for cmd_id, cmd_config in filtered_commands.items():
+            if not first:
+                yield b','
+            yield orjson.dumps(cmd_id) + b':' + orjson.dumps(cmd_config)
+            first = False
+        yield b'}'
+
+    return Response(stream(), mimetype='application/json')
 
 @app.route('/api/platform')
 def get_platform():
     """Endpoint to return current platform information"""
-    os_type = platform.system().lower()
-    return jsonify({
-        'os': os_type,
-        'platform': 'windows' if os_type == 'windows' else 'unix',
-        'system': platform.system(),
-        'machine': platform.machine(),
-        'version': platform.version()
-    })
+    return Response(orjson.dumps({
+        'os': OS_TYPE,
+        'platform': CURRENT_PLATFORM,
+        'system': SYSTEM,
+        'machine': MACHINE,
+        'version': VERSION
+    }), mimetype='application/json')
 
 @app.route('/execute/<tool>', methods=['POST'])
 def execute_tool(tool):
-    commands = load_commands()
-    filtered_commands = filter_commands_by_platform(commands)
-    
-    if tool not in filtered_commands:
+    compiled_commands = load_compiled_commands()
+
+    if tool not in compiled_commands:
         return Response('Command not found or not supported on this platform', mimetype='text/plain')
-    
-    execution_id = str(uuid.uuid4())
+
+    cmd, error = _build_argv(compiled_commands[tool], request.json)
+    if error:
+        # Fail before allocating an id, a generator, or a subprocess.
+        return Response(error, status=400, mimetype='text/plain')
+
+    execution_id = _new_execution_id()
+    quiet = request.headers.get('X-Quiet') == '1'
     return Response(
-        execute_command(tool, commands[tool], request.json, execution_id), 
+        execute_command(cmd, execution_id, quiet),
         mimetype='text/plain',
-        headers={'X-Execution-ID': execution_id}
+        headers={'X-Execution-ID': execution_id},
+        direct_passthrough=True
     )
 
 @app.route('/stop/<execution_id>', methods=['POST'])
 def stop_execution(execution_id):
-    if execution_id in running_processes:
+    # pop() is atomic under the GIL, so the generator thread and this one
+    # can never both claim (and double-terminate) the same process.
+    entry = running_processes.pop(execution_id, None)
+    if entry:
+        process, stop_event = entry
         try:
-            process = running_processes[execution_id]
-            process.terminate()
-            del running_processes[execution_id]
+            stop_event.set()
+            _terminate(process)
             return jsonify({'status': 'stopped'})
         except:
             return jsonify({'status': 'error'})
-    
+
     return jsonify({'status': 'not_found'})
 
-def execute_command(tool, config, data, execution_id):
-    os_type = platform.system().lower()
-    cmd_config = config.get('windows' if os_type == 'windows' else 'unix', config.get('command'))
-    
-    if not cmd_config:
-        yield 'Command not supported on this system\n'
-        return
-    
-    cmd = [cmd_config['base']]
-    
-    for option in config['options']:
-        opt_id = option['id']
-        value = data.get(opt_id)
-        
-        if 'platforms' in option:
-            current_platform = 'windows' if os_type == 'windows' else 'unix'
-            if current_platform not in option['platforms']:
-                continue 
-        
-        if not value and option.get('required'):
-            yield f'Error: {option["label"]} is required\n'
-            return
-        
-        if value:
-            if option['type'] == 'checkbox':
-                if value:
-                    flag = cmd_config['flags'].get(opt_id)
-                    if flag:
-                        if isinstance(flag, list):
-                            cmd.extend(flag)
-                        else:
-                            cmd.append(flag)
+def _build_argv(compiled, data):
+    """Validate the request payload and return (argv, None) or (None, error)."""
+    cmd = [compiled.base]
+
+    for option in compiled.options:
+        value = data.get(option.id)
+
+        if not value and option.required:
+            return None, f'Error: {option.label} is required\n'
+
+        if value and option.flag:
+            if option.type == 'checkbox':
+                cmd += option.flag
             else:
-                flag = cmd_config['flags'].get(opt_id)
-                if flag:
-                    if isinstance(flag, list):
-                        cmd.extend(flag)
-                        cmd.append(str(value))
-                    else:
-                        cmd.extend([flag, str(value)])
-    
-    target = data.get(config['target'])
+                cmd += (*option.flag, str(value))
+
+    target = data.get(compiled.target) if compiled.target else None
     if target:
         cmd.append(target)
-    
+
+    return cmd, None
+
+def execute_command(cmd, execution_id, quiet=False):
     try:
         process = subprocess.Popen(
             cmd,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
-            universal_newlines=True,
-            bufsize=1
+            bufsize=0,
+            **_POPEN_GROUP_KWARGS
         )
         
-        running_processes[execution_id] = process
-        
-        yield f'Executing: {" ".join(cmd)}\n'
-        yield f'Execution ID: {execution_id}\n'
-        yield f'System: {platform.system()} ({platform.machine()})\n\n'
-        
-        for line in iter(process.stdout.readline, ''):
-            if execution_id not in running_processes:
-                yield '\nExecution interrupted\n'
-                break
-            yield line
-            
+        stop_event = threading.Event()
+        running_processes[execution_id] = (process, stop_event)
+
+        if not quiet:
+            # Single pre-encoded chunk: one allocation ahead of the first
+            # byte of tool output, and properly quoted via shlex.
+            yield (f'Executing: {shlex.join(cmd)}\n'
+                   f'Execution ID: {execution_id}\n'
+                   f'System: {SYSTEM} ({MACHINE})\n\n').encode()
+
+        # Bound method in a local: one C-level flag check per chunk instead of
+        # hashing into the global dict.
+        stopped = stop_event.is_set
+
+        if os.name == 'posix':
+            # Drain the pipe with non-blocking chunk reads instead of
+            # Python-level readline() calls, which stall on partial lines.
+            fd = process.stdout.fileno()
+            os.set_blocking(fd, False)
+            sel = selectors.DefaultSelector()
+            sel.register(fd, selectors.EVENT_READ)
+            try:
+                while True:
+                    if stopped():
+                        yield b'\nExecution interrupted\n'
+                        break
+                    if not sel.select(timeout=0.1):
+                        if process.poll() is not None:
+                            # The leader is gone and the pipe is idle: only a
+                            # forked helper can still hold the write end open.
+                            # Kill the group instead of waiting out the helper.
+                            _terminate(process)
+                            break
+                        continue
+                    chunk = os.read(fd, 65536)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                sel.close()
+        else:
+            # Windows pipes cannot be select()ed; with bufsize=0 a raw read
+            # still returns as soon as any bytes are available.
+            while True:
+                chunk = process.stdout.read(65536)
+                if not chunk:
+                    break
+                if stopped():
+                    yield b'\nExecution interrupted\n'
+                    break
+                yield chunk
+
+
         process.wait()
-        
-        if execution_id in running_processes:
-            del running_processes[execution_id]
-            yield f'\nProcess finished with exit code: {process.returncode}\n'
-        
+
+        if running_processes.pop(execution_id, None):
+            _terminate(process)  # reap any helpers left in the group
+            yield f'\nProcess finished with exit code: {process.returncode}\n'.encode()
+
     except Exception as e:
-        if execution_id in running_processes:
-            del running_processes[execution_id]
-        yield f'Error: {str(e)}\n'
+        running_processes.pop(execution_id, None)
+        yield f'Error: {str(e)}\n'.encode()
 
+# Production: gunicorn -w $(nproc) -k gthread --threads 8 app:app
+# `python app.py` starts Werkzeug's dev server, which adds significant
+# per-request overhead; debug mode must be opted into with FLASK_DEBUG=1.
 if __name__ == '__main__':
-    app.run(debug=True, threaded=True)
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)